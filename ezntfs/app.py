@@ -27,11 +27,30 @@ from pathlib import Path
 import shutil
 import subprocess
 import sys
+import time
+import tracemalloc
 
 from . import ezntfs
+from . import usage
 from . import __version__
 
-logging.basicConfig(format="[%(asctime)s] %(message)s")
+
+def parse_usage_report_interval(value):
+    try:
+        interval = float(value) if value is not None else None
+    except ValueError:
+        interval = None
+
+    return interval if interval is not None and 0 < interval < float("inf") else None
+
+
+# Interval (in seconds) for logging memory and thread usage, disabled if not set (or not a positive number)
+USAGE_REPORT_INTERVAL = parse_usage_report_interval(os.getenv('EZNTFS_USAGE_REPORT_INTERVAL'))
+
+logging.basicConfig(
+    format="[%(asctime)s] %(message)s",
+    level=logging.INFO if USAGE_REPORT_INTERVAL is not None else logging.WARNING,
+)
 
 def create_icon(symbol, description, fallback_image):
     # System symbols are only available on macOS 11.0+
@@ -70,6 +89,10 @@ class AppDelegate(NSObject):
             self.observeMountChanges()
             self.goNext()
 
+        if USAGE_REPORT_INTERVAL is not None:
+            tracemalloc.start()
+            self.performSelectorInBackground_withObject_(self.doReportUsage_, USAGE_REPORT_INTERVAL)
+
     def runOnMainThread_with_(self, method, payload):
         self.performSelectorOnMainThread_withObject_waitUntilDone_(
             method, payload, False
@@ -83,6 +106,7 @@ class AppDelegate(NSObject):
         self.mount_queue = deque()
         self.mounting = None
         self.last_mount_failed = None
+        self.last_mount_failed_reason = None
 
     def initializeAppUi(self):
         status_bar = NSStatusBar.systemStatusBar()
@@ -116,6 +140,14 @@ class AppDelegate(NSObject):
             self.handleFail_(("Failed to detect the environment", False))
             logging.exception(exc)
 
+    def doReportUsage_(self, interval):
+        while True:
+            time.sleep(interval)
+            logging.info(
+                f"Usage: {usage.format_usage(usage.get_usage())},"
+                + f" {len(self.volumes)} volume(s), {len(self.mount_queue)} queued"
+            )
+
     def observeMountChanges(self):
         workspace = NSWorkspace.sharedWorkspace()
         notification_center = workspace.notificationCenter()
@@ -263,7 +295,9 @@ class AppDelegate(NSObject):
             self.addTextItem_withLabel_(menu, self.failure)
         else:
             if self.last_mount_failed is not None:
-                self.addTextItem_withLabel_(menu, f"Failed to mount: {self.last_mount_failed.name}")
+                item = self.addTextItem_withLabel_(menu, f"Failed to mount: {self.last_mount_failed.name}")
+                if self.last_mount_failed_reason is not None:
+                    item.setToolTip_(self.last_mount_failed_reason)
                 menu.addItem_(NSMenuItem.separatorItem())
 
             if self.state is AppState.RELOADING and len(self.volumes) == 0:
@@ -288,6 +322,7 @@ class AppDelegate(NSObject):
     def addTextItem_withLabel_(self, menu, label):
         item = menu.addItemWithTitle_action_keyEquivalent_(label, "", "")
         item.setEnabled_(False)
+        return item
 
     def addVolumeItems_(self, menu):
         if len(self.volumes) == 0:
@@ -332,20 +367,24 @@ class AppDelegate(NSObject):
             if volume.access is ezntfs.Access.WRITABLE:
                 return self.runOnMainThread_with_(self.handleMountVolumeOk_, volume)
 
+            reason = ezntfs.check_device(volume.node)
+            if reason is not None:
+                return self.runOnMainThread_with_(self.handleMountVolumeFail_, (volume, reason))
+
             if volume.mounted:
                 ok = ezntfs.macos_unmount(volume)
                 if not ok:
-                    return self.runOnMainThread_with_(self.handleMountVolumeFail_, volume)
+                    return self.runOnMainThread_with_(self.handleMountVolumeFail_, (volume, None))
 
             ok = ezntfs.mount(volume, version=self.env.ntfs_3g, path=volume.mount_path)
             if not ok:
                 if volume.mounted:
                     ezntfs.macos_mount(volume)
-                return self.runOnMainThread_with_(self.handleMountVolumeFail_, volume)
+                return self.runOnMainThread_with_(self.handleMountVolumeFail_, (volume, None))
 
             self.runOnMainThread_with_(self.handleMountVolumeOk_, volume)
         except Exception as exc:
-            self.runOnMainThread_with_(self.handleMountVolumeFail_, volume)
+            self.runOnMainThread_with_(self.handleMountVolumeFail_, (volume, None))
             logging.exception(exc)
 
     def handleMountVolumeOk_(self, volume):
@@ -356,16 +395,19 @@ class AppDelegate(NSObject):
         self.addVolume_(volume._replace(access=ezntfs.Access.WRITABLE))
         self.mounting = None
         self.last_mount_failed = None
+        self.last_mount_failed_reason = None
         self.goNext()
 
-    def handleMountVolumeFail_(self, volume):
+    def handleMountVolumeFail_(self, pair_volume_reason):
         if self.state in [AppState.SOFT_FAIL, AppState.HARD_FAIL]:
             return
 
+        volume, reason = pair_volume_reason
         self.state = AppState.READY
         self.needs_reload = True
         self.mounting = None
         self.last_mount_failed = volume
+        self.last_mount_failed_reason = reason
         self.goNext()
 
 
@@ -376,7 +418,7 @@ def main():
     command = sys.argv[1]
 
     if command == "install":
-        return install()
+        return install(with_helper="--with-helper" in sys.argv[2:])
     elif command == "uninstall":
         return uninstall()
 
@@ -413,9 +455,36 @@ LAUNCHD_CONFIG_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
         <string>{error_log_path}</string>
     </dict>
 </plist>"""
+HELPER_NAME = f"{APP_NAME}.helper"
+HELPER_LAUNCHD_CONFIG_PATH = f"/Library/LaunchDaemons/{HELPER_NAME}.plist"
+HELPER_LAUNCHD_CONFIG_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+    <dict>
+        <key>Label</key>
+        <string>{helper_name}</string>
+        <key>EnvironmentVariables</key>
+        <dict>
+            <key>NTFS_3G_PATH</key>
+            <string>{ntfs_3g_path}</string>
+            <key>EZNTFS_HELPER_UID</key>
+            <string>{user_id}</string>
+            <key>EZNTFS_HELPER_GID</key>
+            <string>{group_id}</string>
+        </dict>
+        <key>Program</key>
+        <string>{helper_path}</string>
+        <key>RunAtLoad</key>
+        <true/>
+        <key>KeepAlive</key>
+        <true/>
+        <key>StandardErrorPath</key>
+        <string>{error_log_path}</string>
+    </dict>
+</plist>"""
 
 
-def install():
+def install(with_helper=False):
     user = os.getenv("SUDO_USER")
     user_id = os.getenv("SUDO_UID")
     group_id = os.getenv("SUDO_GID")
@@ -439,6 +508,24 @@ def install():
         print("Could not find ezntfs-app in the path")
         return
 
+    helper_path = shutil.which("ezntfs-helper")
+    if with_helper and helper_path is None:
+        print("Could not find ezntfs-helper in the path")
+        return
+
+    if with_helper:
+        # The helper runs as root, so anyone who can modify its code could run anything as root
+        interpreter_path = get_interpreter_path(helper_path)
+        if interpreter_path is None:
+            print(f"Could not find the interpreter of {helper_path}")
+            return
+
+        for path in [helper_path, interpreter_path, os.path.dirname(ezntfs.__file__)]:
+            unsafe_path = find_unsafe_path(path)
+            if unsafe_path is not None:
+                print(f"{unsafe_path} must be owned by root and not writable by others, refusing to install the helper")
+                return
+
     sudoers_config_path = f"/private/etc/sudoers.d/{APP_NAME.replace('.', '-')}"
     with open(sudoers_config_path, "w") as sudoers_config_file:
         sudoers_config_file.write(f"%#{group_id}\t\tALL = NOPASSWD: {ezntfs.NTFS_3G_PATH}\n")
@@ -458,6 +545,9 @@ def install():
     os.chmod(sudoers_config_path, 0o640)
     os.chown(launchd_config_path, int(user_id), int(group_id))
 
+    if with_helper:
+        install_helper(helper_path, user_id, group_id)
+
     subprocess.run(["su", "-", user, "-c", f"launchctl unload -F {launchd_config_path}"], capture_output=True)
     subprocess.run(["su", "-", user, "-c", f"launchctl load -F {launchd_config_path}"], capture_output=True)
 
@@ -465,11 +555,65 @@ def install():
     print("NOTE: You may need to grant python access to removable volumes.")
 
 
+def install_helper(helper_path, user_id, group_id):
+    with open(HELPER_LAUNCHD_CONFIG_PATH, "w") as helper_launchd_config_file:
+        helper_launchd_config_file.write(HELPER_LAUNCHD_CONFIG_TEMPLATE.format(
+            helper_name=HELPER_NAME,
+            ntfs_3g_path=ezntfs.NTFS_3G_PATH,
+            user_id=user_id,
+            group_id=group_id,
+            helper_path=helper_path,
+            error_log_path=f"/Library/Logs/{HELPER_NAME}.log",
+        ))
+
+    os.chown(HELPER_LAUNCHD_CONFIG_PATH, 0, 0)
+    os.chmod(HELPER_LAUNCHD_CONFIG_PATH, 0o644)
+
+    subprocess.run(["launchctl", "unload", "-F", HELPER_LAUNCHD_CONFIG_PATH], capture_output=True)
+    subprocess.run(["launchctl", "load", "-F", HELPER_LAUNCHD_CONFIG_PATH], capture_output=True)
+
+
+def get_interpreter_path(script_path):
+    with open(script_path, "rb") as script_file:
+        first_line = script_file.readline()
+
+    if not first_line.startswith(b"#!"):
+        return None
+
+    args = first_line[2:].decode(errors="replace").split()
+    # Only absolute paths can be trusted, e.g. not "/usr/bin/env python3" (which depends on the PATH)
+    if len(args) == 0 or not os.path.isabs(args[0]) or os.path.basename(args[0]) in ["env", "sh", "bash"]:
+        return None
+
+    return args[0]
+
+
+def find_unsafe_path(path):
+    # Returns the first path (the file itself, or a directory on the way to it) not safe to run as root,
+    # checking both the path as given and where its symlinks lead
+    for path in [os.path.abspath(path), os.path.realpath(path)]:
+        while True:
+            info = os.stat(path)
+            if info.st_uid != 0 or info.st_mode & 0o022 != 0:
+                return path
+
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+    return None
+
+
 def uninstall():
     if os.geteuid() != 0:
         print("Need root to remove sudoers config, try again with sudo")
         return
 
+    if os.path.exists(HELPER_LAUNCHD_CONFIG_PATH):
+        subprocess.run(["launchctl", "unload", "-F", HELPER_LAUNCHD_CONFIG_PATH], capture_output=True)
+        os.remove(HELPER_LAUNCHD_CONFIG_PATH)
+
     with contextlib.suppress(FileNotFoundError):
         os.remove(f"/private/etc/sudoers.d/{APP_NAME.replace('.', '-')}")
 
@@ -82,6 +82,11 @@ def mount_volume(volume, version):
         print(f"{volume.name} is already writable.")
         return True
 
+    reason = ezntfs.check_device(volume.node)
+    if reason is not None:
+        print(f"Cannot mount {volume.name}: {reason}.")
+        return False
+
     if volume.mounted:
         print("Unmounting...")
         ok = ezntfs.macos_unmount(volume)
@@ -1,16 +1,23 @@
 from collections import namedtuple
 from enum import Enum
+import json
 import os
 import re
 import shutil
+import socket
 import subprocess
 
+from . import ntfs
 
 EnvironmentInfo = namedtuple("EnvironmentInfo", ["fuse", "ntfs_3g", "can_mount"])
 Volume = namedtuple("Volume", ["id", "node", "name", "mounted", "mount_path", "size", "access", "internal"])
 Access = Enum("Access", ["READ_ONLY", "WRITABLE", "NOT_APPLICABLE", "UNKNOWN"])
 
 NTFS_3G_PATH = os.getenv("NTFS_3G_PATH", shutil.which("ntfs-3g"))
+HELPER_SOCKET_PATH = os.getenv("EZNTFS_HELPER_SOCKET", "/var/run/com.lezgomatt.ezntfs.helper.sock")
+HELPER_TIMEOUT = 5
+# Mounting can take a while, e.g. when ntfs-3g has to replay the journal
+HELPER_MOUNT_TIMEOUT = 60
 
 
 def get_environment_info():
@@ -26,7 +33,7 @@ def get_environment_info():
     can_mount = (
         fuse is not None
         and ntfs_3g is not None
-        and subprocess.run(test_cmd, capture_output=True).returncode == 0
+        and (can_use_helper() or subprocess.run(test_cmd, capture_output=True).returncode == 0)
     )
 
     return EnvironmentInfo(fuse=fuse, ntfs_3g=ntfs_3g, can_mount=can_mount)
@@ -59,6 +66,7 @@ def get_all_ntfs_volumes():
     # "Windows_NTFS" is used for MBR partition tables and "Microsoft Basic Data" for GPT.
     # To determine the actual file system used, we use `diskutil info` later on.
     # Simpler volumes might not have a partition type set, so we always check those too.
+    # Since `diskutil info` is slow, we first sniff the boot sector to skip anything that isn't NTFS.
 
     list_out = run(["diskutil", "list"], capture_output=True)
     lines = list_out.split("\n")
@@ -72,7 +80,30 @@ def get_all_ntfs_volumes():
         or re.match(r"\s*0:\s*", line) and line[type_last_char_index] == " "
     ]
 
-    return { vol.id: vol for vol in map(get_ntfs_volume, disk_ids) if vol is not None }
+    return { vol.id: vol for vol in map(get_ntfs_volume, filter_ntfs_candidates(disk_ids)) if vol is not None }
+
+
+def filter_ntfs_candidates(disk_ids):
+    # Only drops the disks we know aren't NTFS, disks we fail to sniff are left for `diskutil info`
+    is_ntfs = { id: sniff_ntfs(f"/dev/{id}") for id in disk_ids }
+
+    # Device nodes are usually only readable by root, but the helper can sniff them for us
+    unknown = [id for id, result in is_ntfs.items() if result is None]
+    if len(unknown) > 0 and os.geteuid() != 0:
+        response = call_helper("sniff", nodes=[f"/dev/{id}" for id in unknown])
+        if response is not None and response["ok"]:
+            is_ntfs.update(zip(unknown, response["ntfs"]))
+
+    return [id for id in disk_ids if is_ntfs[id] is not False]
+
+
+def sniff_ntfs(node):
+    try:
+        oem_id = ntfs.read_oem_id(node)
+    except OSError:
+        return None
+
+    return oem_id == ntfs.NTFS_OEM_ID if oem_id is not None else None
 
 
 def get_ntfs_volume(idOrPath):
@@ -116,10 +147,39 @@ def get_ntfs_volume(idOrPath):
     )
 
 
+def check_device(node):
+    # Returns the reason why ntfs-3g would refuse to mount the device,
+    # or None if it should mount fine (or if we can't tell)
+    try:
+        status = ntfs.read_volume_status(node)
+    except PermissionError:
+        # Device nodes are usually only readable by root, but the helper can check for us
+        response = call_helper("check", node=node) if os.geteuid() != 0 else None
+        return response.get("reason") if response is not None and response["ok"] else None
+    except OSError:
+        return None
+
+    if status is None:
+        return None
+    elif status.hibernated:
+        return "Windows is hibernated (or has Fast Startup enabled), shut it down fully first"
+    elif status.dirty:
+        return "Volume is marked dirty, check it with chkdsk on Windows first"
+    else:
+        return None
+
+
 def mount(volume, version=None, path=None):
     if path is None:
         path = genrate_path(volume)
 
+    # Prefer the privileged helper when it is installed, this avoids going through sudo
+    # The helper always mounts as the user it was installed for, so root skips it
+    if os.geteuid() != 0:
+        response = call_helper("mount", timeout=HELPER_MOUNT_TIMEOUT, node=volume.node, path=path)
+        if response is not None:
+            return response["ok"]
+
     cmd = build_mount_command(
         volume,
         version=version,
@@ -149,6 +209,37 @@ def build_mount_command(volume, *, version, user_id, group_id, path):
     ]
 
 
+def can_use_helper():
+    if os.geteuid() == 0:
+        return False
+
+    response = call_helper("ping")
+    return response is not None and response["ok"]
+
+
+def call_helper(command, timeout=HELPER_TIMEOUT, **args):
+    # Returns None if the helper is not available, so the caller can fall back to sudo
+    if not os.path.exists(HELPER_SOCKET_PATH):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    with sock:
+        try:
+            sock.connect(HELPER_SOCKET_PATH)
+        except OSError:
+            return None
+
+        # Once connected, the request may already be in progress, so never fall back past this point
+        try:
+            sock.sendall(json.dumps(dict(args, command=command)).encode() + b"\n")
+            with sock.makefile("rb") as sock_file:
+                return json.loads(sock_file.readline())
+        except (OSError, ValueError):
+            return { "ok": False, "error": "No response from the helper" }
+
+
 def genrate_path(volume):
     path = f"/Volumes/{volume.name}"
     if not os.path.exists(path):
@@ -0,0 +1,152 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import socketserver
+import stat
+import sys
+
+from . import ezntfs
+
+logging.basicConfig(format="[%(asctime)s] %(message)s")
+
+DEVICE_NODE_PATTERN = re.compile(r"/dev/disk\d+(s\d+)?")
+MOUNT_PATH_PATTERN = re.compile(r"/Volumes/[^/\0]+")
+
+
+class HelperServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, user_id, group_id, version):
+        self.user_id = user_id
+        self.group_id = group_id
+        self.version = version
+
+        # Make sure the socket is never accessible by other users, not even briefly
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, HelperRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        os.chown(socket_path, user_id, group_id)
+
+
+class HelperRequestHandler(socketserver.StreamRequestHandler):
+    # Requests are handled one at a time, so a client that never sends (or reads) must not block the others
+    timeout = 5
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError:
+            logging.warning("Timed out waiting for a request")
+            return
+
+        try:
+            request = json.loads(line)
+            response = handle_request(self.server, request)
+        except Exception as exc:
+            response = { "ok": False, "error": "Failed to handle the request" }
+            logging.exception(exc)
+
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def handle_request(server, request):
+    command = request.get("command")
+
+    if command == "ping":
+        return { "ok": True }
+
+    if command == "check":
+        return check(request.get("node"))
+
+    if command == "sniff":
+        return sniff(request.get("nodes"))
+
+    if command == "mount":
+        return mount(server, request.get("node"), request.get("path"))
+
+    return { "ok": False, "error": f"Unknown command: {command}" }
+
+
+def is_device_node(node):
+    return (
+        isinstance(node, str)
+        and DEVICE_NODE_PATTERN.fullmatch(node) is not None
+        and os.path.exists(node)
+        and stat.S_ISBLK(os.stat(node).st_mode)
+    )
+
+
+def check(node):
+    if not is_device_node(node):
+        return { "ok": False, "error": "Invalid device node" }
+
+    return { "ok": True, "reason": ezntfs.check_device(node) }
+
+
+def sniff(nodes):
+    if not isinstance(nodes, list) or not all(is_device_node(node) for node in nodes):
+        return { "ok": False, "error": "Invalid device node" }
+
+    return { "ok": True, "ntfs": [ezntfs.sniff_ntfs(node) for node in nodes] }
+
+
+def mount(server, node, path):
+    if not is_device_node(node):
+        return { "ok": False, "error": "Invalid device node" }
+
+    if not isinstance(path, str) or MOUNT_PATH_PATTERN.fullmatch(path) is None or path.endswith(("/.", "/..")):
+        return { "ok": False, "error": "Invalid mount path" }
+
+    # Never mount over a symlink (e.g. "/Volumes/Macintosh HD" points to "/") or another volume
+    if os.path.islink(path) or os.path.ismount(path):
+        return { "ok": False, "error": "Mount path is in use" }
+
+    if os.path.exists(path) and (not os.path.isdir(path) or len(os.listdir(path)) > 0):
+        return { "ok": False, "error": "Mount path is in use" }
+
+    # Only trust what diskutil reports, never the volume details from the client
+    volume = ezntfs.get_ntfs_volume(node)
+    if volume is None or volume.node != node:
+        return { "ok": False, "error": "Not an NTFS volume" }
+
+    if volume.mounted:
+        return { "ok": False, "error": "Volume is already mounted" }
+
+    # ntfs-3g splits its options on commas, so a volume name could smuggle in options like "allow_other"
+    if "," in volume.name:
+        return { "ok": False, "error": "Volume name contains a comma" }
+
+    cmd = ezntfs.build_mount_command(
+        volume,
+        version=server.version,
+        user_id=server.user_id,
+        group_id=server.group_id,
+        path=path,
+    )
+
+    ok = ezntfs.run(cmd)
+    return { "ok": ok } if ok else { "ok": False, "error": "Failed to mount via ntfs-3g" }
+
+
+def main():
+    if os.geteuid() != 0:
+        sys.exit("ERROR: The helper needs to run as root.")
+
+    user_id = os.getenv("EZNTFS_HELPER_UID")
+    group_id = os.getenv("EZNTFS_HELPER_GID")
+    if user_id is None or group_id is None:
+        sys.exit("ERROR: EZNTFS_HELPER_UID and EZNTFS_HELPER_GID must be set.")
+
+    version = ezntfs.get_ntfs_3g_version()
+    if version is None:
+        sys.exit("ERROR: Failed to detect ntfs-3g.")
+
+    # Clean up the socket left behind by a previous run
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(ezntfs.HELPER_SOCKET_PATH)
+
+    with HelperServer(ezntfs.HELPER_SOCKET_PATH, int(user_id), int(group_id), version) as server:
+        server.serve_forever()
@@ -0,0 +1,331 @@
+from collections import namedtuple
+import os
+import struct
+
+# Just enough of the on-disk NTFS format to tell whether a device holds NTFS at all,
+# and whether ntfs-3g would refuse to mount it, read straight from the device
+# so that nothing has to be unmounted (or passed to `diskutil info`) to find out.
+
+VolumeStatus = namedtuple("VolumeStatus", ["dirty", "hibernated"])
+BootSector = namedtuple("BootSector", ["cluster_size", "mft_offset", "record_size", "index_block_size"])
+Attribute = namedtuple("Attribute", ["type", "name", "value", "runs", "size"])
+
+SECTOR_SIZE = 512
+# Reads are capped per check, so a corrupt (or malicious) volume can never make us read much of the device
+MAX_READ_BYTES = 4 * 1024 * 1024
+
+NTFS_OEM_ID = b"NTFS    "
+VOLUME_RECORD = 3
+ROOT_RECORD = 5
+VOLUME_IS_DIRTY = 0x0001
+
+ATTR_VOLUME_INFORMATION = 0x70
+ATTR_DATA = 0x80
+ATTR_INDEX_ROOT = 0x90
+ATTR_INDEX_ALLOCATION = 0xA0
+ATTR_END = 0xFFFFFFFF
+
+
+class ReadBudgetExceeded(Exception):
+    # Not a ValueError, so that code skipping over bad blocks can never skip past the budget
+    pass
+
+
+class DeviceReader:
+    def __init__(self, fd, budget=MAX_READ_BYTES):
+        self.fd = fd
+        self.budget = budget
+
+    def read(self, offset, size):
+        # Raw devices only support reads aligned to the sector size
+        start = offset - offset % SECTOR_SIZE
+        end = -(-(offset + size) // SECTOR_SIZE) * SECTOR_SIZE
+
+        self.budget -= end - start
+        if self.budget < 0:
+            raise ReadBudgetExceeded()
+
+        data = os.pread(self.fd, end - start, start)
+        if len(data) < end - start:
+            raise ValueError("Unexpected end of device")
+
+        return data[offset - start:offset - start + size]
+
+
+def read_oem_id(path):
+    """Return the OEM ID from the boot sector at path (e.g. "NTFS    " or "EXFAT   "), or None if there is none.
+
+    Raises OSError if the device cannot be read.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return DeviceReader(fd, budget=SECTOR_SIZE).read(3, 8)
+    except ValueError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def read_volume_status(path):
+    """Return the VolumeStatus of the NTFS volume at path, or None if it is not a (valid) NTFS volume.
+
+    Raises OSError if the device cannot be read.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return parse_volume_status(DeviceReader(fd))
+    except OSError:
+        raise
+    except Exception:
+        # Corrupt metadata can fail in many ways, none of which should stop us from trying to mount
+        return None
+    finally:
+        os.close(fd)
+
+
+def parse_volume_status(reader):
+    boot = parse_boot_sector(reader.read(0, SECTOR_SIZE))
+    if boot is None:
+        return None
+
+    mft_record = read_record(reader, boot, boot.mft_offset)
+    mft_runs = require_attribute(mft_record, ATTR_DATA, resident=False).runs
+
+    def read_mft_record(number):
+        offset = stream_offset(mft_runs, number * boot.record_size, boot.cluster_size)
+        if offset is None:
+            raise ValueError("MFT record is not allocated")
+        return read_record(reader, boot, offset)
+
+    volume_info = require_attribute(read_mft_record(VOLUME_RECORD), ATTR_VOLUME_INFORMATION, resident=True).value
+    if len(volume_info) < 12:
+        raise ValueError("$VOLUME_INFORMATION is too short")
+    (volume_flags,) = struct.unpack_from("<H", volume_info, 10)
+
+    hiberfil_number = find_in_root(reader, boot, read_mft_record(ROOT_RECORD), "hiberfil.sys")
+    hibernated = (
+        hiberfil_number is not None
+        and is_hibernation_file(reader, boot, read_mft_record(hiberfil_number))
+    )
+
+    return VolumeStatus(dirty=bool(volume_flags & VOLUME_IS_DIRTY), hibernated=hibernated)
+
+
+def parse_boot_sector(data):
+    if data[3:11] != NTFS_OEM_ID:
+        return None
+
+    bytes_per_sector, sectors_per_cluster = struct.unpack_from("<HB", data, 0x0B)
+    (mft_cluster,) = struct.unpack_from("<Q", data, 0x30)
+    clusters_per_record, clusters_per_index_block = struct.unpack_from("<b3xb", data, 0x40)
+
+    # Large cluster sizes are stored as a negative power of two
+    if sectors_per_cluster > 0x80:
+        sectors_per_cluster = 1 << (256 - sectors_per_cluster)
+
+    cluster_size = bytes_per_sector * sectors_per_cluster
+    if cluster_size == 0 or bytes_per_sector % SECTOR_SIZE != 0:
+        raise ValueError("Invalid cluster size")
+
+    def to_bytes(clusters):
+        return clusters * cluster_size if clusters > 0 else 1 << -clusters
+
+    boot = BootSector(
+        cluster_size=cluster_size,
+        mft_offset=mft_cluster * cluster_size,
+        record_size=to_bytes(clusters_per_record),
+        index_block_size=to_bytes(clusters_per_index_block),
+    )
+
+    if boot.record_size < SECTOR_SIZE or boot.index_block_size < SECTOR_SIZE:
+        raise ValueError("Invalid record or index block size")
+
+    return boot
+
+
+def read_record(reader, boot, offset):
+    record = apply_fixups(reader.read(offset, boot.record_size), b"FILE")
+
+    (flags,) = struct.unpack_from("<H", record, 0x16)
+    if not flags & 0x0001:
+        raise ValueError("MFT record is not in use")
+
+    return record
+
+
+def apply_fixups(data, magic):
+    # The last two bytes of every sector are swapped out for an update sequence number,
+    # which lets NTFS detect torn writes; the original bytes are stored in the update sequence array
+    if data[:4] != magic:
+        raise ValueError(f"Missing {magic} signature")
+
+    usa_offset, usa_count = struct.unpack_from("<HH", data, 4)
+    usn = data[usa_offset:usa_offset + 2]
+    data = bytearray(data)
+
+    for i in range(1, usa_count):
+        end = i * SECTOR_SIZE
+        if end > len(data) or data[end - 2:end] != usn:
+            raise ValueError("Fixup mismatch")
+        data[end - 2:end] = data[usa_offset + 2 * i:usa_offset + 2 * i + 2]
+
+    return bytes(data)
+
+
+def iter_attributes(record):
+    (offset,) = struct.unpack_from("<H", record, 0x14)
+
+    while offset + 8 <= len(record):
+        attr_type, length = struct.unpack_from("<II", record, offset)
+        if attr_type == ATTR_END or length == 0:
+            return
+
+        non_resident, name_length, name_offset = struct.unpack_from("<BBH", record, offset + 8)
+        name = record[offset + name_offset:offset + name_offset + 2 * name_length].decode("utf-16-le")
+
+        if non_resident:
+            (runs_offset,) = struct.unpack_from("<H", record, offset + 0x20)
+            (size,) = struct.unpack_from("<Q", record, offset + 0x30)
+            runs = decode_runs(record[offset + runs_offset:offset + length])
+            yield Attribute(type=attr_type, name=name, value=None, runs=runs, size=size)
+        else:
+            value_length, value_offset = struct.unpack_from("<IH", record, offset + 0x10)
+            value = record[offset + value_offset:offset + value_offset + value_length]
+            yield Attribute(type=attr_type, name=name, value=value, runs=None, size=value_length)
+
+        offset += length
+
+
+def find_attribute(record, attr_type, name=""):
+    return next((a for a in iter_attributes(record) if a.type == attr_type and a.name == name), None)
+
+
+def require_attribute(record, attr_type, name="", resident=None):
+    attr = find_attribute(record, attr_type, name)
+    if attr is None:
+        raise ValueError(f"Missing attribute 0x{attr_type:X}")
+
+    # Corrupt records could store any attribute either way, so never assume
+    if resident is True and attr.value is None:
+        raise ValueError(f"Attribute 0x{attr_type:X} must be resident")
+    if resident is False and attr.runs is None:
+        raise ValueError(f"Attribute 0x{attr_type:X} must be non-resident")
+
+    return attr
+
+
+def decode_runs(data):
+    # Each run is a header byte (sizes of the length and offset fields), a length, and an offset
+    # relative to the previous run; a missing offset means the run is sparse
+    runs = []
+    lcn = 0
+    pos = 0
+
+    while pos < len(data) and data[pos] != 0:
+        length_size = data[pos] & 0x0F
+        offset_size = data[pos] >> 4
+        pos += 1
+
+        length = int.from_bytes(data[pos:pos + length_size], "little")
+        pos += length_size
+
+        if offset_size == 0:
+            runs.append((None, length))
+        else:
+            lcn += int.from_bytes(data[pos:pos + offset_size], "little", signed=True)
+            runs.append((lcn, length))
+        pos += offset_size
+
+    return runs
+
+
+def stream_offset(runs, offset, cluster_size):
+    vcn, remainder = divmod(offset, cluster_size)
+
+    for lcn, length in runs:
+        if vcn < length:
+            return None if lcn is None else (lcn + vcn) * cluster_size + remainder
+        vcn -= length
+
+    raise ValueError("Offset is past the end of the stream")
+
+
+def iter_index_entries(data):
+    pos = 0
+
+    while pos + 16 <= len(data):
+        file_reference, length, key_length, flags = struct.unpack_from("<QHHH", data, pos)
+        if flags & 0x02 or length == 0:
+            return
+
+        key = data[pos + 16:pos + 16 + key_length]
+        if key_length < 0x42 or len(key) < key_length or 16 + key_length > length:
+            raise ValueError("Index entry is too short")
+
+        name_length = key[0x40]
+        if 0x42 + 2 * name_length > len(key):
+            raise ValueError("Index entry name is too long")
+
+        yield file_reference & 0xFFFFFFFFFFFF, key[0x42:0x42 + 2 * name_length].decode("utf-16-le")
+
+        pos += length
+
+
+def find_in_root(reader, boot, root_record, name):
+    # Walks every node of the root directory index, instead of descending the B+ tree,
+    # since that would need the volume's upcase table to compare names
+    index_root = require_attribute(root_record, ATTR_INDEX_ROOT, "$I30", resident=True).value
+    if len(index_root) < 32:
+        raise ValueError("$INDEX_ROOT is too short")
+    entries_offset, index_length = struct.unpack_from("<II", index_root, 16)
+    nodes = [index_root[16 + entries_offset:16 + index_length]]
+
+    allocation = find_attribute(root_record, ATTR_INDEX_ALLOCATION, "$I30")
+    if allocation is not None:
+        if allocation.runs is None:
+            raise ValueError("$INDEX_ALLOCATION must be non-resident")
+
+        # The size comes straight from the device, so bound the walk by time (blocks visited), not just bytes read
+        if allocation.size > sum(length for lcn, length in allocation.runs) * boot.cluster_size:
+            raise ValueError("$INDEX_ALLOCATION is larger than its runs")
+        if -(-allocation.size // boot.index_block_size) > MAX_READ_BYTES // boot.index_block_size:
+            raise ValueError("$INDEX_ALLOCATION has too many blocks")
+
+        for block_offset in range(0, allocation.size, boot.index_block_size):
+            offset = stream_offset(allocation.runs, block_offset, boot.cluster_size)
+            if offset is None:
+                continue
+
+            try:
+                block = apply_fixups(reader.read(offset, boot.index_block_size), b"INDX")
+            except ValueError:
+                # Unused index blocks might not be initialized
+                continue
+
+            entries_offset, index_length = struct.unpack_from("<II", block, 0x18)
+            nodes.append(block[0x18 + entries_offset:0x18 + index_length])
+
+    for node in nodes:
+        for number, entry_name in iter_index_entries(node):
+            if entry_name.lower() == name:
+                return number
+
+    return None
+
+
+def is_hibernation_file(reader, boot, record):
+    data = require_attribute(record, ATTR_DATA)
+
+    if data.size < 4:
+        return False
+
+    if data.runs is None:
+        signature = data.value[:4]
+    else:
+        offset = stream_offset(data.runs, 0, boot.cluster_size)
+        if offset is None:
+            return False
+        signature = reader.read(offset, 4)
+
+    # Windows writes "hibr" (or "HIBR" for Fast Startup) when hibernating, and "wake" once resumed
+    return signature.lower() == b"hibr"
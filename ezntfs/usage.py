@@ -0,0 +1,32 @@
+from collections import namedtuple
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+
+Usage = namedtuple("Usage", ["rss", "threads", "traced"])
+
+
+def get_usage():
+    return Usage(
+        rss=get_rss(),
+        threads=threading.active_count(),
+        traced=tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+    )
+
+
+def get_rss():
+    # The current RSS is only easy to get on Linux, elsewhere (e.g. macOS) we fall back to the peak RSS
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports the peak RSS in bytes, Linux in kilobytes
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def format_usage(usage):
+    traced = f", traced {usage.traced / 2**20:.2f} MiB" if usage.traced is not None else ""
+    return f"RSS {usage.rss / 2**20:.1f} MiB, {usage.threads} thread(s){traced}"
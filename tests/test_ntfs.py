@@ -0,0 +1,46 @@
+import pytest
+
+from ezntfs import ntfs
+from ezntfs.ntfs import VolumeStatus
+from tools import images
+
+CLEAN = VolumeStatus(dirty=False, hibernated=False)
+
+CASES = [
+    pytest.param(dict(), CLEAN, id="clean"),
+    pytest.param(dict(dirty=True), VolumeStatus(dirty=True, hibernated=False), id="dirty"),
+    pytest.param(dict(hibernation=b"hibr"), VolumeStatus(dirty=False, hibernated=True), id="hibernated"),
+    pytest.param(dict(hibernation=b"HIBR"), VolumeStatus(dirty=False, hibernated=True), id="fast startup"),
+    pytest.param(dict(hibernation=b"wake"), CLEAN, id="resumed"),
+    pytest.param(
+        dict(hibernation=b"HIBR", hiberfil_in_allocation=True),
+        VolumeStatus(dirty=False, hibernated=True),
+        id="hiberfil.sys in $INDEX_ALLOCATION",
+    ),
+    pytest.param(dict(hiberfil_in_allocation=True), CLEAN, id="no hiberfil.sys in $INDEX_ALLOCATION"),
+] + [
+    # Corrupt volumes must never crash the check, they just can't be checked
+    pytest.param(dict(hibernation=b"HIBR", corruption=corruption), None, id=f"corrupt: {corruption}")
+    for corruption in images.CORRUPTIONS
+]
+
+BOOT_SECTOR_CASES = [
+    pytest.param(b"EXFAT   ", id="exFAT"),
+    pytest.param(b"MSDOS5.0", id="FAT32"),
+]
+
+
+@pytest.mark.parametrize("options, expected", CASES)
+def test_read_volume_status(tmp_path, options, expected):
+    path = tmp_path / "volume.img"
+    images.build_ntfs_image(path, **options)
+
+    assert ntfs.read_volume_status(path) == expected
+
+
+@pytest.mark.parametrize("oem_id", BOOT_SECTOR_CASES)
+def test_read_volume_status_other_file_systems(tmp_path, oem_id):
+    path = tmp_path / "volume.img"
+    images.build_boot_sector_image(path, oem_id)
+
+    assert ntfs.read_volume_status(path) is None
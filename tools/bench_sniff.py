@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from ezntfs import ezntfs
+from tools import images
+
+# Benchmarks sniffing boot sectors against images with mixed file systems (see images.py),
+# and compares it with spawning one subprocess per candidate, which is the least `diskutil info` could cost.
+# Run from the repository root with: python -m tools.bench_sniff
+
+FILE_SYSTEMS = [
+    ("NTFS", None),
+    ("exFAT", b"EXFAT   "),
+    ("FAT32", b"MSDOS5.0"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sniffing NTFS boot sectors against mixed images.")
+    parser.add_argument("--images", type=int, default=90, help="number of images (split between file systems)")
+    parser.add_argument("--repeat", type=int, default=10, help="number of passes over all images")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = build_images(directory, args.images, random.Random(args.seed))
+
+        results = [ezntfs.sniff_ntfs(path) for path, expected in paths]
+        mismatches = [path for (path, expected), result in zip(paths, results) if result != expected]
+
+        started_at = time.perf_counter()
+        for _ in range(args.repeat):
+            for path, expected in paths:
+                ezntfs.sniff_ntfs(path)
+        sniff_time = (time.perf_counter() - started_at) / (args.repeat * len(paths))
+
+        started_at = time.perf_counter()
+        for _ in paths:
+            subprocess.run(["true"])
+        spawn_time = (time.perf_counter() - started_at) / len(paths)
+
+    skipped = results.count(False)
+    print(f"Images: {len(paths)} ({results.count(True)} NTFS, {skipped} skipped, {results.count(None)} unknown)")
+    print(f"Sniff: {sniff_time * 1e6:.1f}us per image")
+    print(f"Subprocess spawn: {spawn_time * 1e6:.1f}us per candidate")
+    print(f"Saved per listing: at least {skipped * (spawn_time - sniff_time) * 1000:.1f}ms")
+
+    if len(mismatches) > 0:
+        print(f"FAIL: Wrong results for {', '.join(os.path.basename(path) for path in mismatches)}.")
+        sys.exit(1)
+
+
+def build_images(directory, count, rng):
+    # Returns (path, expected sniff result) pairs
+    paths = []
+
+    for i in range(count):
+        name, oem_id = FILE_SYSTEMS[i % len(FILE_SYSTEMS)]
+        path = os.path.join(directory, f"{i}-{name}.img")
+        if oem_id is None:
+            images.build_ntfs_image(path, dirty=rng.random() < 0.5)
+        else:
+            images.build_boot_sector_image(path, oem_id)
+        paths.append((path, oem_id is None))
+
+    # A device too small to hold a boot sector can't be sniffed, and is left for `diskutil info`
+    path = os.path.join(directory, "truncated.img")
+    images.build_boot_sector_image(path, b"", size=100)
+    paths.append((path, None))
+
+    rng.shuffle(paths)
+    return paths
+
+
+if __name__ == "__main__":
+    main()
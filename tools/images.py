@@ -0,0 +1,221 @@
+import struct
+
+# Builds tiny synthetic disk images, with just enough of each file system for ntfs.py to parse,
+# so that the device checks can be exercised (see tests/test_ntfs.py and bench_sniff.py) without real disks.
+
+CLUSTER_SIZE = 4096
+RECORD_SIZE = 1024
+IMAGE_CLUSTERS = 64
+
+MFT_CLUSTER = 4
+HIBERFIL_CLUSTER = 20
+INDEX_BLOCK_CLUSTER = 30
+HIBERFIL_RECORD = 10
+
+CORRUPTIONS = [
+    "fixups",
+    "short_index_key",
+    "non_resident_volume_information",
+    "non_resident_index_root",
+    "resident_index_allocation",
+    "huge_index_allocation",
+    "index_allocation_past_runs",
+]
+
+
+def build_ntfs_image(path, dirty=False, hibernation=None, hiberfil_in_allocation=False, corruption=None):
+    """Write an NTFS image to path.
+
+    hibernation is the signature of hiberfil.sys (e.g. b"HIBR" or b"wake"), or None for no hiberfil.sys.
+    """
+    if corruption is not None and corruption not in CORRUPTIONS:
+        raise ValueError(f"Unknown corruption: {corruption}")
+
+    image = bytearray(IMAGE_CLUSTERS * CLUSTER_SIZE)
+    image[:512] = boot_sector()
+
+    records = {}
+    records[0] = mft_record([non_resident_attribute(0x80, runlist(MFT_CLUSTER, 4), 16 * RECORD_SIZE)])
+
+    volume_information = bytearray(12)
+    struct.pack_into("<H", volume_information, 10, 0x0001 if dirty else 0x0000)
+    records[3] = mft_record([
+        non_resident_attribute(0x70, runlist(HIBERFIL_CLUSTER, 1), 12)
+        if corruption == "non_resident_volume_information"
+        else resident_attribute(0x70, bytes(volume_information))
+    ])
+
+    entries = [index_entry(3, "$Volume")]
+    if corruption == "short_index_key":
+        entries.append(struct.pack("<QHHHH", 4, 24, 8, 0, 0) + bytes(8))
+
+    hiberfil_entries = []
+    if hibernation is not None:
+        hiberfil_entries.append(index_entry(HIBERFIL_RECORD, "hiberfil.sys"))
+        offset = HIBERFIL_CLUSTER * CLUSTER_SIZE
+        image[offset:offset + len(hibernation)] = hibernation
+        records[HIBERFIL_RECORD] = mft_record([
+            non_resident_attribute(0x80, runlist(HIBERFIL_CLUSTER, 1), CLUSTER_SIZE),
+        ])
+
+    root_attributes = []
+    if hiberfil_in_allocation:
+        offset = INDEX_BLOCK_CLUSTER * CLUSTER_SIZE
+        image[offset:offset + CLUSTER_SIZE] = index_block(index_node(hiberfil_entries))
+        root_attributes.append(non_resident_attribute(0xA0, runlist(INDEX_BLOCK_CLUSTER, 1), CLUSTER_SIZE, "$I30"))
+    else:
+        entries += hiberfil_entries
+
+    if corruption == "resident_index_allocation":
+        root_attributes.append(resident_attribute(0xA0, bytes(32), "$I30"))
+
+    # A single sparse run of 2^40 clusters covers 2^52 bytes, far too many index blocks to walk
+    if corruption == "huge_index_allocation":
+        root_attributes.append(non_resident_attribute(0xA0, sparse_runlist(2**40), 2**52, "$I30"))
+    if corruption == "index_allocation_past_runs":
+        root_attributes.append(non_resident_attribute(0xA0, sparse_runlist(1), 2**52, "$I30"))
+
+    node = index_node(entries)
+    index_root = bytearray(32)
+    struct.pack_into("<II", index_root, 16, 16, 16 + len(node))
+    index_root = bytes(index_root) + node
+    records[5] = mft_record([
+        non_resident_attribute(0x90, runlist(HIBERFIL_CLUSTER, 1), len(index_root), "$I30")
+        if corruption == "non_resident_index_root"
+        else resident_attribute(0x90, index_root, "$I30")
+    ] + root_attributes)
+
+    mft_offset = MFT_CLUSTER * CLUSTER_SIZE
+    for number, record in records.items():
+        image[mft_offset + number * RECORD_SIZE:mft_offset + (number + 1) * RECORD_SIZE] = record
+
+    if corruption == "fixups":
+        image[mft_offset + 3 * RECORD_SIZE + 510] ^= 0xFF
+
+    with open(path, "wb") as image_file:
+        image_file.write(image)
+
+
+def build_boot_sector_image(path, oem_id, size=IMAGE_CLUSTERS * CLUSTER_SIZE):
+    """Write an image to path that only has a boot sector with the given OEM ID (e.g. b"EXFAT   ")."""
+    image = bytearray(size)
+    image[3:3 + len(oem_id)] = oem_id
+
+    with open(path, "wb") as image_file:
+        image_file.write(image)
+
+
+def boot_sector():
+    sector = bytearray(512)
+    sector[3:11] = b"NTFS    "
+    struct.pack_into("<HB", sector, 0x0B, 512, CLUSTER_SIZE // 512)
+    struct.pack_into("<Q", sector, 0x30, MFT_CLUSTER)
+    # Records are 2^10 bytes (stored as a negative power of two), index blocks are 1 cluster
+    struct.pack_into("<b3xb", sector, 0x40, -10, 1)
+    return bytes(sector)
+
+
+def runlist(lcn, length):
+    offset_size = (lcn.bit_length() + 8) // 8
+    return bytes([(offset_size << 4) | 1, length]) + lcn.to_bytes(offset_size, "little", signed=True) + b"\0"
+
+
+def sparse_runlist(length):
+    length_size = (length.bit_length() + 7) // 8
+    return bytes([length_size]) + length.to_bytes(length_size, "little") + b"\0"
+
+
+def resident_attribute(attr_type, value, name=""):
+    encoded_name = name.encode("utf-16-le")
+    name_offset = 0x18
+    value_offset = align(name_offset + len(encoded_name))
+    length = align(value_offset + len(value))
+
+    attribute = bytearray(length)
+    struct.pack_into("<IIBBH", attribute, 0, attr_type, length, 0, len(name), name_offset)
+    struct.pack_into("<IH", attribute, 0x10, len(value), value_offset)
+    attribute[name_offset:name_offset + len(encoded_name)] = encoded_name
+    attribute[value_offset:value_offset + len(value)] = value
+    return bytes(attribute)
+
+
+def non_resident_attribute(attr_type, runs, size, name=""):
+    encoded_name = name.encode("utf-16-le")
+    name_offset = 0x40
+    runs_offset = align(name_offset + len(encoded_name))
+    length = align(runs_offset + len(runs))
+
+    attribute = bytearray(length)
+    struct.pack_into("<IIBBH", attribute, 0, attr_type, length, 1, len(name), name_offset)
+    struct.pack_into("<H", attribute, 0x20, runs_offset)
+    struct.pack_into("<QQQ", attribute, 0x28, size, size, size)
+    attribute[name_offset:name_offset + len(encoded_name)] = encoded_name
+    attribute[runs_offset:runs_offset + len(runs)] = runs
+    return bytes(attribute)
+
+
+def mft_record(attributes):
+    record = bytearray(RECORD_SIZE)
+    record[:4] = b"FILE"
+    usa_offset = 0x30
+    usa_count = RECORD_SIZE // 512 + 1
+    attributes_offset = align(usa_offset + 2 * usa_count)
+
+    struct.pack_into("<HH", record, 4, usa_offset, usa_count)
+    # Flags: the record is in use
+    struct.pack_into("<HH", record, 0x14, attributes_offset, 0x0001)
+
+    body = b"".join(attributes) + struct.pack("<I", 0xFFFFFFFF)
+    record[attributes_offset:attributes_offset + len(body)] = body
+
+    return apply_fixups(record, usa_offset, usa_count)
+
+
+def index_entry(record_number, name):
+    encoded_name = name.encode("utf-16-le")
+    key = bytearray(0x42 + len(encoded_name))
+    key[0x40] = len(name)
+    # Namespace: Win32
+    key[0x41] = 1
+    key[0x42:] = encoded_name
+
+    length = align(16 + len(key))
+    entry = bytearray(length)
+    struct.pack_into("<QHHH", entry, 0, record_number, length, len(key), 0)
+    entry[16:16 + len(key)] = key
+    return bytes(entry)
+
+
+def index_node(entries):
+    last_entry = struct.pack("<QHHHH", 0, 16, 0, 0x02, 0)
+    return b"".join(entries) + last_entry
+
+
+def index_block(node):
+    block = bytearray(CLUSTER_SIZE)
+    block[:4] = b"INDX"
+    usa_offset = 0x28
+    usa_count = CLUSTER_SIZE // 512 + 1
+    entries_offset = align(usa_offset + 2 * usa_count) - 0x18
+
+    struct.pack_into("<HH", block, 4, usa_offset, usa_count)
+    struct.pack_into("<III", block, 0x18, entries_offset, entries_offset + len(node), CLUSTER_SIZE - 0x18)
+    block[0x18 + entries_offset:0x18 + entries_offset + len(node)] = node
+
+    return apply_fixups(block, usa_offset, usa_count)
+
+
+def apply_fixups(data, usa_offset, usa_count):
+    # The reverse of ntfs.apply_fixups: stash the last two bytes of each sector, replace them with the USN
+    usn = b"\x01\x00"
+    data[usa_offset:usa_offset + 2] = usn
+    for i in range(1, usa_count):
+        end = i * 512
+        data[usa_offset + 2 * i:usa_offset + 2 * i + 2] = data[end - 2:end]
+        data[end - 2:end] = usn
+
+    return bytes(data)
+
+
+def align(offset):
+    return (offset + 7) // 8 * 8
@@ -0,0 +1,699 @@
+from collections import Counter, namedtuple
+import argparse
+import contextlib
+import logging
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+
+from ezntfs import ezntfs
+
+# The simulator drives the real AppDelegate logic without macOS, so that it can run headless (e.g. on Linux).
+# It stands in for the few Cocoa classes the app uses, runs a fake main thread,
+# and replaces diskutil and ntfs-3g with a fake system that answers with a configurable latency.
+# Reads from device nodes are answered by the fake system too, so real disks are never touched.
+# Run from the repository root with: python -m tools.simulator
+
+Disk = namedtuple("Disk", ["id", "name", "file_system", "internal", "mounted", "mount_path", "writable"])
+Report = namedtuple("Report", [
+    "events_injected",
+    "events_handled",
+    "elapsed",
+    "subprocesses",
+    "device_reads",
+    "threads_started",
+    "queue_latencies",
+    "recoveries",
+])
+
+FAKE_NTFS_3G_PATH = "/usr/local/bin/ntfs-3g"
+FAKE_ENVIRONMENT = ezntfs.EnvironmentInfo(fuse="macfuse", ntfs_3g=(2022, 10, 3, 0), can_mount=True)
+
+MOUNT_NOTIFICATION = "NSWorkspaceDidMountNotification"
+UNMOUNT_NOTIFICATION = "NSWorkspaceDidUnmountNotification"
+RENAME_NOTIFICATION = "NSWorkspaceDidRenameVolumeNotification"
+URL_KEY = "NSWorkspaceVolumeURLKey"
+OLD_URL_KEY = "NSWorkspaceVolumeOldURLKey"
+LOCALIZED_NAME_KEY = "NSWorkspaceVolumeLocalizedNameKey"
+
+
+class RunLoop:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.threads = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.latencies = []
+        self.threads_started = 0
+        self.notifications_handled = 0
+
+    def post(self, method, payload, notification=False):
+        self.queue.put((time.perf_counter(), method, payload, notification))
+
+    def spawn(self, method, payload):
+        thread = threading.Thread(target=method, args=(payload,), daemon=True)
+        self.threads = [t for t in self.threads if t.is_alive()]
+        self.threads.append(thread)
+        self.threads_started += 1
+        thread.start()
+
+    def run_once(self, timeout=0):
+        try:
+            entry = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+        except queue.Empty:
+            return False
+
+        posted_at, method, payload, notification = entry
+        self.latencies.append(time.perf_counter() - posted_at)
+        method(payload)
+        if notification:
+            self.notifications_handled += 1
+        return True
+
+    def is_busy(self):
+        self.threads = [t for t in self.threads if t.is_alive()]
+        return len(self.threads) > 0 or not self.queue.empty()
+
+
+class FakeNSObject:
+    @classmethod
+    def new(cls):
+        return cls()
+
+    def performSelectorOnMainThread_withObject_waitUntilDone_(self, method, payload, wait):
+        self.simulator_loop.post(method, payload)
+
+    def performSelectorInBackground_withObject_(self, method, payload):
+        self.simulator_loop.spawn(method, payload)
+
+
+class FakeURL:
+    def __init__(self, path):
+        self._path = path
+
+    def path(self):
+        return self._path
+
+
+class FakeNotification:
+    def __init__(self, user_info):
+        self._user_info = user_info
+
+    def userInfo(self):
+        return self._user_info
+
+
+class FakeNotificationCenter:
+    def __init__(self):
+        self.observers = []
+
+    def addObserver_selector_name_object_(self, observer, selector, name, obj):
+        self.observers.append((observer, selector.replace(":", "_"), name))
+
+    def post(self, name, user_info):
+        for observer, method_name, observed_name in self.observers:
+            if observed_name == name:
+                observer.simulator_loop.post(getattr(observer, method_name), FakeNotification(user_info), notification=True)
+
+
+class FakeWorkspace:
+    shared = None
+
+    @classmethod
+    def sharedWorkspace(cls):
+        return cls.shared
+
+    def __init__(self):
+        self.notification_center = FakeNotificationCenter()
+
+    def notificationCenter(self):
+        return self.notification_center
+
+
+class FakeMenuItem:
+    def __init__(self, title="", action=""):
+        self.title = title
+        self.action = action
+        self.enabled = True
+        self.represented_object = None
+
+    @classmethod
+    def separatorItem(cls):
+        return cls()
+
+    def setEnabled_(self, enabled):
+        self.enabled = enabled
+
+    def setRepresentedObject_(self, obj):
+        self.represented_object = obj
+
+    def representedObject(self):
+        return self.represented_object
+
+    def setState_(self, state):
+        pass
+
+    def setToolTip_(self, tooltip):
+        pass
+
+
+class FakeMenu:
+    def __init__(self):
+        self.items = []
+
+    @classmethod
+    def new(cls):
+        return cls()
+
+    def setAutoenablesItems_(self, flag):
+        pass
+
+    def removeAllItems(self):
+        self.items = []
+
+    def addItem_(self, item):
+        self.items.append(item)
+
+    def addItemWithTitle_action_keyEquivalent_(self, title, action, key):
+        item = FakeMenuItem(title, action)
+        self.items.append(item)
+        return item
+
+
+class FakeButton:
+    def setTitle_(self, title):
+        pass
+
+    def setImage_(self, image):
+        pass
+
+    def setToolTip_(self, tooltip):
+        pass
+
+
+class FakeStatusItem:
+    def __init__(self):
+        self._button = FakeButton()
+        self._menu = None
+        self.visible = False
+
+    def button(self):
+        return self._button
+
+    def setMenu_(self, menu):
+        self._menu = menu
+
+    def menu(self):
+        return self._menu
+
+    def setVisible_(self, visible):
+        self.visible = visible
+
+
+class FakeStatusBar:
+    @classmethod
+    def systemStatusBar(cls):
+        return cls()
+
+    def statusItemWithLength_(self, length):
+        return FakeStatusItem()
+
+
+class FakeImage:
+    @classmethod
+    def imageWithSystemSymbolName_accessibilityDescription_(cls, symbol, description):
+        return symbol
+
+
+def install_fake_cocoa():
+    if "ezntfs.app" in sys.modules:
+        return sys.modules["ezntfs.app"]
+
+    foundation = types.ModuleType("Foundation")
+    foundation.NSObject = FakeNSObject
+
+    appkit = types.ModuleType("AppKit")
+    appkit.NSApplication = None
+    appkit.NSApplicationActivationPolicyProhibited = 2
+    appkit.NSControlStateValueOn = 1
+    appkit.NSImage = FakeImage
+    appkit.NSMenu = FakeMenu
+    appkit.NSMenuItem = FakeMenuItem
+    appkit.NSStatusBar = FakeStatusBar
+    appkit.NSVariableStatusItemLength = -1
+    appkit.NSWorkspace = FakeWorkspace
+    appkit.NSWorkspaceDidMountNotification = MOUNT_NOTIFICATION
+    appkit.NSWorkspaceDidRenameVolumeNotification = RENAME_NOTIFICATION
+    appkit.NSWorkspaceDidUnmountNotification = UNMOUNT_NOTIFICATION
+    appkit.NSWorkspaceVolumeLocalizedNameKey = LOCALIZED_NAME_KEY
+    appkit.NSWorkspaceVolumeOldURLKey = OLD_URL_KEY
+    appkit.NSWorkspaceVolumeURLKey = URL_KEY
+
+    pyobjctools = types.ModuleType("PyObjCTools")
+    pyobjctools.AppHelper = types.ModuleType("PyObjCTools.AppHelper")
+
+    sys.modules.update({
+        "Foundation": foundation,
+        "AppKit": appkit,
+        "PyObjCTools": pyobjctools,
+        "PyObjCTools.AppHelper": pyobjctools.AppHelper,
+    })
+
+    from ezntfs import app
+    return app
+
+
+class FakeSystem:
+    def __init__(self, workspace, diskutil_latency, mount_latency, rng):
+        self.workspace = workspace
+        self.diskutil_latency = diskutil_latency
+        self.mount_latency = mount_latency
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.subprocesses = Counter()
+        self.device_reads = Counter()
+        self.disk_counter = 1
+        self.disks = {}
+
+        self.add_disk(Disk(
+            id="disk0s3", name="BOOTCAMP", file_system="ntfs", internal=True,
+            mounted=True, mount_path="/Volumes/BOOTCAMP", writable=False,
+        ))
+
+    def add_disk(self, disk):
+        self.disks[disk.id] = disk
+
+    def find_disk(self, id_or_path):
+        return next(
+            (d for d in self.disks.values() if id_or_path in [d.id, f"/dev/{d.id}", d.mount_path]),
+            None,
+        )
+
+    def post(self, name, **user_info):
+        self.workspace.notificationCenter().post(name, user_info)
+
+    def run(self, command, capture_output=False):
+        if command[0] == "sudo":
+            command = command[2:]
+
+        program = "ntfs-3g" if command[0] == ezntfs.NTFS_3G_PATH else command[0]
+        action = command[1] if program == "diskutil" else None
+        self.subprocesses[f"{program} {action}" if action is not None else program] += 1
+
+        time.sleep(self.mount_latency if program == "ntfs-3g" or action in ["mount", "unmount"] else self.diskutil_latency)
+
+        with self.lock:
+            if program == "ntfs-3g":
+                result = self.ntfs_3g(node=command[-2], path=command[-1])
+            elif action == "list":
+                result = self.diskutil_list()
+            elif action == "info":
+                result = self.diskutil_info(command[2])
+            elif action == "mount":
+                result = self.diskutil_mount(command[2])
+            elif action == "unmount":
+                result = self.diskutil_unmount(command[2])
+            else:
+                result = None
+
+        if capture_output and result is None:
+            raise subprocess.CalledProcessError(1, command)
+
+        return result if capture_output else result is not None
+
+    def sniff_ntfs(self, node):
+        self.device_reads["sniff"] += 1
+
+        with self.lock:
+            disk = self.find_disk(node)
+            # Like a device node that is gone, unknown disks can't be sniffed
+            return disk.file_system == "ntfs" if disk is not None else None
+
+    def check_device(self, node):
+        self.device_reads["check"] += 1
+
+        # The fake disks are never hibernated or dirty
+        return None
+
+    def diskutil_list(self):
+        row = "{:>5}{:>27} {:<23} {:<10} {}"
+        lines = [
+            "/dev/disk0 (internal, physical):",
+            row.format("#:", "TYPE", "NAME", "SIZE", "IDENTIFIER"),
+            row.format("0:", "GUID_partition_scheme", "", "*500.3 GB", "disk0"),
+            row.format("1:", "EFI", "EFI", "209.7 MB", "disk0s1"),
+            row.format("2:", "Apple_APFS", "Container disk1", "400.0 GB", "disk0s2"),
+            row.format("3:", "Microsoft Basic Data", "BOOTCAMP", "100.0 GB", "disk0s3"),
+            "",
+        ]
+
+        for disk in self.disks.values():
+            if disk.internal:
+                continue
+
+            whole_id = disk.id.rsplit("s", 1)[0]
+            lines += [
+                f"/dev/{whole_id} (external, physical):",
+                row.format("#:", "TYPE", "NAME", "SIZE", "IDENTIFIER"),
+                row.format("0:", "FDisk_partition_scheme", "", "*32.0 GB", whole_id),
+                row.format("1:", "Windows_NTFS", disk.name, "32.0 GB", disk.id),
+                "",
+            ]
+
+        return "\n".join(lines)
+
+    def diskutil_info(self, id_or_path):
+        disk = self.find_disk(id_or_path)
+        if disk is None:
+            return None
+
+        info = {
+            "Device Identifier": disk.id,
+            "Device Node": f"/dev/{disk.id}",
+            "Volume Name": disk.name,
+            "Mounted": "Yes" if disk.mounted else "No",
+            "File System Personality": disk.file_system.upper(),
+            "Type (Bundle)": disk.file_system,
+            "Disk Size": "32.0 GB (32000000000 Bytes) (exactly 62500000 512-Byte-Units)",
+            "Device Location": "Internal" if disk.internal else "External",
+            "Media Read-Only": "No",
+            "Volume Read-Only": (
+                "Not applicable (not mounted)" if not disk.mounted
+                else "No" if disk.writable
+                else "Yes (read-only mount flag set)"
+            ),
+        }
+        if disk.mounted:
+            info["Mount Point"] = disk.mount_path
+
+        return "\n".join(f"   {key}:{' ' * (28 - len(key))}{value}" for key, value in info.items()) + "\n"
+
+    def diskutil_mount(self, id):
+        disk = self.find_disk(id)
+        if disk is None or disk.mounted:
+            return None
+
+        path = f"/Volumes/{disk.name}"
+        self.add_disk(disk._replace(mounted=True, mount_path=path, writable=False))
+        self.post(MOUNT_NOTIFICATION, **{URL_KEY: FakeURL(path)})
+        return ""
+
+    def diskutil_unmount(self, id):
+        disk = self.find_disk(id)
+        if disk is None or not disk.mounted:
+            return None
+
+        self.add_disk(disk._replace(mounted=False, mount_path=None, writable=False))
+        self.post(UNMOUNT_NOTIFICATION, **{URL_KEY: FakeURL(disk.mount_path)})
+        return ""
+
+    def ntfs_3g(self, node, path):
+        disk = self.find_disk(node)
+        if disk is None or disk.mounted or disk.file_system != "ntfs":
+            return None
+
+        self.add_disk(disk._replace(mounted=True, mount_path=path, writable=True))
+        self.post(MOUNT_NOTIFICATION, **{URL_KEY: FakeURL(path)})
+        return ""
+
+    def plug(self):
+        with self.lock:
+            number = self.disk_counter
+            self.disk_counter += 1
+
+            name = f"VOLUME{number}"
+            path = f"/Volumes/{name}"
+            self.add_disk(Disk(
+                id=f"disk{number + 1}s1",
+                name=name,
+                # Not every "Windows_NTFS" partition is actually NTFS
+                file_system="ntfs" if self.rng.random() < 0.8 else "exfat",
+                internal=False,
+                mounted=True,
+                mount_path=path,
+                writable=False,
+            ))
+            self.post(MOUNT_NOTIFICATION, **{URL_KEY: FakeURL(path)})
+
+    def unplug(self):
+        with self.lock:
+            external = [d for d in self.disks.values() if not d.internal]
+            if len(external) == 0:
+                return False
+
+            disk = self.rng.choice(external)
+            del self.disks[disk.id]
+            if disk.mounted:
+                self.post(UNMOUNT_NOTIFICATION, **{URL_KEY: FakeURL(disk.mount_path)})
+            return True
+
+    def rename(self):
+        with self.lock:
+            mounted = [d for d in self.disks.values() if d.mounted and not d.internal]
+            if len(mounted) == 0:
+                return False
+
+            disk = self.rng.choice(mounted)
+            name = f"{disk.name.split('-')[0]}-{self.rng.randrange(1000)}"
+            path = f"/Volumes/{name}"
+            self.add_disk(disk._replace(name=name, mount_path=path))
+            self.post(
+                RENAME_NOTIFICATION,
+                **{OLD_URL_KEY: FakeURL(disk.mount_path), URL_KEY: FakeURL(path), LOCALIZED_NAME_KEY: name},
+            )
+            return True
+
+    def external_disk_count(self):
+        with self.lock:
+            return sum(1 for d in self.disks.values() if not d.internal)
+
+
+@contextlib.contextmanager
+def patched_backend(system):
+    originals = (
+        ezntfs.run,
+        ezntfs.sniff_ntfs,
+        ezntfs.check_device,
+        ezntfs.get_environment_info,
+        ezntfs.NTFS_3G_PATH,
+        ezntfs.HELPER_SOCKET_PATH,
+    )
+
+    ezntfs.run = system.run
+    ezntfs.sniff_ntfs = system.sniff_ntfs
+    ezntfs.check_device = system.check_device
+    ezntfs.get_environment_info = lambda: FAKE_ENVIRONMENT
+    ezntfs.NTFS_3G_PATH = FAKE_NTFS_3G_PATH
+    ezntfs.HELPER_SOCKET_PATH = "/nonexistent/ezntfs-simulator.sock"
+
+    try:
+        yield
+    finally:
+        (
+            ezntfs.run,
+            ezntfs.sniff_ntfs,
+            ezntfs.check_device,
+            ezntfs.get_environment_info,
+            ezntfs.NTFS_3G_PATH,
+            ezntfs.HELPER_SOCKET_PATH,
+        ) = originals
+
+
+class Simulator:
+    def __init__(self, diskutil_latency=0.005, mount_latency=0.02, max_disks=8, seed=0):
+        self.app = install_fake_cocoa()
+        # The usage report runs forever in the background, so the app would never look idle
+        self.app.USAGE_REPORT_INTERVAL = None
+        self.rng = random.Random(seed)
+        self.max_disks = max_disks
+
+        FakeWorkspace.shared = FakeWorkspace()
+        self.loop = RunLoop()
+        self.system = FakeSystem(FakeWorkspace.shared, diskutil_latency, mount_latency, self.rng)
+
+        self.delegate = self.app.AppDelegate.new()
+        self.delegate.simulator_loop = self.loop
+
+    def start(self):
+        with patched_backend(self.system):
+            self.delegate.applicationDidFinishLaunching_(None)
+            self.drain()
+
+    def run(self, events, rate=0, settle=True, timeout=60):
+        # With settle, the app finishes all the work for each event before the next one,
+        # without it, a burst of events is coalesced into fewer reloads
+        self.loop.reset_stats()
+        self.system.subprocesses.clear()
+        self.system.device_reads.clear()
+        injected = 0
+        clicks = 0
+        recoveries = 0
+
+        started_at = time.perf_counter()
+
+        with patched_backend(self.system):
+            while injected < events:
+                if rate > 0:
+                    next_event_at = started_at + injected / rate
+                    while time.perf_counter() < next_event_at:
+                        self.loop.run_once(timeout=next_event_at - time.perf_counter())
+                else:
+                    while self.loop.run_once():
+                        pass
+
+                if self.delegate.state is self.app.AppState.SOFT_FAIL:
+                    self.delegate.handleReloadClicked_(None)
+                    recoveries += 1
+
+                action = self.inject_event()
+                if action is None:
+                    continue
+
+                injected += 1
+                clicks += action == "click"
+
+                if settle:
+                    self.drain(timeout)
+
+            self.drain(timeout)
+
+        elapsed = time.perf_counter() - started_at
+
+        return Report(
+            events_injected=injected,
+            events_handled=self.loop.notifications_handled + clicks + recoveries,
+            elapsed=elapsed,
+            subprocesses=Counter(self.system.subprocesses),
+            device_reads=Counter(self.system.device_reads),
+            threads_started=self.loop.threads_started,
+            queue_latencies=sorted(self.loop.latencies),
+            recoveries=recoveries,
+        )
+
+    def inject_event(self):
+        # Returns the action taken, or None if there was nothing to act on (e.g. no disks to unplug)
+        external_disks = self.system.external_disk_count()
+        action = self.rng.choices(["plug", "unplug", "rename", "click"], weights=[3, 3, 1, 3])[0]
+
+        if action == "plug" and external_disks >= self.max_disks:
+            action = "unplug"
+
+        if action == "plug":
+            self.system.plug()
+        elif action == "unplug":
+            if not self.system.unplug():
+                return None
+        elif action == "rename":
+            if not self.system.rename():
+                return None
+        elif action == "click":
+            items = [
+                item for item in self.delegate.status_item.menu().items
+                if item.enabled and item.representedObject() is not None
+            ]
+            if len(items) == 0:
+                return None
+            self.delegate.handleVolumeClicked_(self.rng.choice(items))
+
+        return action
+
+    def is_idle(self):
+        return (
+            not self.loop.is_busy()
+            and (
+                self.delegate.state in [self.app.AppState.SOFT_FAIL, self.app.AppState.HARD_FAIL]
+                or self.delegate.state is self.app.AppState.READY
+                and not self.delegate.needs_reload
+                and len(self.delegate.mount_queue) == 0
+            )
+        )
+
+    def drain(self, timeout=60):
+        deadline = time.perf_counter() + timeout
+        while not self.is_idle():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("The app did not settle down after the simulated events")
+            self.loop.run_once(timeout=0.01)
+
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def print_report(report):
+    total_subprocesses = sum(report.subprocesses.values())
+    latencies = report.queue_latencies
+    mean_latency = sum(latencies) / len(latencies) if len(latencies) > 0 else 0.0
+
+    print(f"Events injected: {report.events_injected}")
+    print(f"Events handled: {report.events_handled} ({report.events_handled / report.elapsed:.1f}/s)")
+    print(f"Elapsed: {report.elapsed:.2f}s")
+    print(f"Subprocesses: {total_subprocesses} ({subprocesses_per_event(report):.2f} per event)")
+    for name, count in sorted(report.subprocesses.items()):
+        print(f"  {name}: {count}")
+    print(f"Device reads: {sum(report.device_reads.values())}")
+    for name, count in sorted(report.device_reads.items()):
+        print(f"  {name}: {count}")
+    print(f"Background threads: {report.threads_started}")
+    print(
+        f"Queue latency: mean {mean_latency * 1000:.2f}ms, p50 {percentile(latencies, 0.5) * 1000:.2f}ms,"
+        + f" p95 {percentile(latencies, 0.95) * 1000:.2f}ms, max {percentile(latencies, 1.0) * 1000:.2f}ms"
+    )
+    print(f"Recoveries from soft failures: {report.recoveries}")
+
+
+def subprocesses_per_event(report):
+    return sum(report.subprocesses.values()) / max(report.events_handled, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate storms of volume events against the ezNTFS app.")
+    parser.add_argument("--events", type=int, default=1000, help="number of events to inject")
+    parser.add_argument("--rate", type=float, default=0, help="events per second to inject (0 = as fast as possible)")
+    parser.add_argument(
+        "--burst",
+        action="store_true",
+        help="inject the next event without waiting for the app to settle, to test coalescing",
+    )
+    parser.add_argument("--diskutil-latency", type=float, default=0.005, help="seconds per fake diskutil call")
+    parser.add_argument("--mount-latency", type=float, default=0.02, help="seconds per fake (un)mount call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-subprocesses-per-event", type=float, help="fail if exceeded")
+    parser.add_argument("--max-queue-latency", type=float, help="fail if the p95 queue latency (in ms) is exceeded")
+    parser.add_argument("--verbose", action="store_true", help="show the errors logged by the app")
+    args = parser.parse_args()
+
+    # Failures are expected (e.g. a volume unplugged mid-reload), the report counts the recoveries instead
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    simulator = Simulator(
+        diskutil_latency=args.diskutil_latency,
+        mount_latency=args.mount_latency,
+        seed=args.seed,
+    )
+    simulator.start()
+    report = simulator.run(args.events, rate=args.rate, settle=not args.burst)
+    print_report(report)
+
+    failed = False
+    if args.max_subprocesses_per_event is not None and subprocesses_per_event(report) > args.max_subprocesses_per_event:
+        print("FAIL: Too many subprocesses per event.")
+        failed = True
+    if args.max_queue_latency is not None and percentile(report.queue_latencies, 0.95) * 1000 > args.max_queue_latency:
+        print("FAIL: Queue latency is too high.")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
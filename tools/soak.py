@@ -0,0 +1,103 @@
+from collections import Counter
+import argparse
+import gc
+import logging
+import sys
+import tracemalloc
+
+from tools.simulator import Simulator
+from ezntfs.usage import format_usage, get_usage
+
+# Drives the app logic through many simulated mount, unmount and rename cycles (see simulator.py)
+# and fails if memory or thread usage keeps growing once the app has warmed up.
+# Growth is measured as the slope across all batches, so a one-off jump (e.g. the first batch after warming up)
+# doesn't count as a leak, but steady growth does, even if it stays small in total.
+# The app settles after every event, so each one goes through its full reload or mount cycle.
+# Run from the repository root with: python -m tools.soak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the ezNTFS app logic for memory and thread leaks.")
+    parser.add_argument("--events", type=int, default=20000, help="number of events to inject after warming up")
+    parser.add_argument("--batch", type=int, default=1000, help="number of events between measurements")
+    parser.add_argument("--diskutil-latency", type=float, default=0.001, help="seconds per fake diskutil call")
+    parser.add_argument("--mount-latency", type=float, default=0.002, help="seconds per fake (un)mount call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-rss-slope", type=float, default=256, help="in bytes per event")
+    parser.add_argument("--max-traced-slope", type=float, default=16, help="in bytes per event")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    tracemalloc.start()
+
+    simulator = Simulator(
+        diskutil_latency=args.diskutil_latency,
+        mount_latency=args.mount_latency,
+        seed=args.seed,
+    )
+    simulator.start()
+
+    # Warm up first, so that caches and lazily created objects don't count as growth
+    simulator.run(args.batch, settle=True)
+    gc.collect()
+    baseline = get_usage()
+    baseline_snapshot = tracemalloc.take_snapshot()
+    print(f"Baseline: {format_usage(baseline)}")
+
+    background_cycles = 0
+    subprocesses = Counter()
+    measurements = []
+    for done in range(args.batch, args.events + 1, args.batch):
+        report = simulator.run(args.batch, settle=True)
+        background_cycles += report.threads_started
+        subprocesses += report.subprocesses
+        gc.collect()
+        usage = get_usage()
+        measurements.append((done, usage))
+        print(f"After {done} events ({report.threads_started} background cycles): {format_usage(usage)}")
+
+    snapshot = tracemalloc.take_snapshot()
+
+    print()
+    print(f"Background cycles (reload, add or mount): {background_cycles}")
+    print(f"Mounts via ntfs-3g: {subprocesses['ntfs-3g']}")
+    print(f"Unmounts: {subprocesses['diskutil unmount']}")
+    print("Top allocation growth:")
+    for stat in snapshot.compare_to(baseline_snapshot, "lineno")[:5]:
+        print(f"  {stat}")
+
+    events = [done for done, usage in measurements]
+    rss_slope = slope(events, [usage.rss for done, usage in measurements])
+    traced_slope = slope(events, [usage.traced for done, usage in measurements])
+    print(f"Growth per event: RSS {rss_slope:.1f} B, traced {traced_slope:.2f} B")
+
+    failed = False
+    if len(measurements) < 3:
+        print("FAIL: Too few batches to measure growth, lower --batch or raise --events.")
+        failed = True
+    if rss_slope > args.max_rss_slope:
+        print(f"FAIL: RSS keeps growing by {rss_slope:.1f} B per event.")
+        failed = True
+    if traced_slope > args.max_traced_slope:
+        print(f"FAIL: Traced memory keeps growing by {traced_slope:.2f} B per event.")
+        failed = True
+    if measurements[-1][1].threads > baseline.threads:
+        print(f"FAIL: Thread count grew from {baseline.threads} to {measurements[-1][1].threads}.")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+def slope(xs, ys):
+    # Least squares fit, so that the trend across all batches counts, not just the first and last one
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return 0.0
+
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+if __name__ == "__main__":
+    main()